@@ -1,16 +1,38 @@
-import json
+from functools import lru_cache
 
+import orjson
 from redis import Redis
 
 from factorization import factorize, Factorization
 
 
+@lru_cache(maxsize=8)
+def _get_redis(cache_url: str) -> Redis:
+    # Reuse one client (and its connection pool) per URL across jobs in the worker process
+    return Redis.from_url(cache_url)
+
+
+@lru_cache(maxsize=4096)
+def _cached_factorize_json(n: int, cache_key: str, cache_url: str) -> bytes:
+    # Results are also kept in worker process memory, so repeated jobs for
+    # the same number (e.g., submitted by a client polling before the first
+    # job finishes) are answered without recomputing or reading them
+    cache_result = _get_redis(cache_url).get(cache_key)
+    if cache_result is None:
+        # Format the factorization once here rather than on every HTTP response
+        factorization = factorize(n)
+        cache_result = orjson.dumps({
+            'factorization': factorization,
+            'factorization_str': ' '.join([str(b) + '^' + str(e) for (b, e) in factorization]),
+        })
+
+    return cache_result
+
+
 def cached_factorize(n: int, cache_key: str, cache_url: str) -> Factorization:
-    cache = Redis.from_url(cache_url)
-    cache_result = cache.get(cache_key)
-    if cache_result is not None:
-        return json.loads(cache_result)
-    else:
-        result = factorize(n)
-        cache.set(cache_key, json.dumps(result))
-        return result
+    cache_result = _cached_factorize_json(n, cache_key, cache_url)
+    # Store the result even if it was remembered locally:  the job may have
+    # been enqueued because redis evicted it since it was first computed
+    _get_redis(cache_url).set(cache_key, cache_result, nx=True)
+    result = orjson.loads(cache_result)
+    return result['factorization']
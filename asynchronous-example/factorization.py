@@ -1,21 +1,61 @@
 #!/usr/bin/env python3
 
-from itertools import count, takewhile
-from math import prod
-from typing import Generator, List, Tuple
+from itertools import compress, count, takewhile
+from math import isqrt, prod
+from typing import Generator, Iterator, List, Tuple
 
 Factorization = List[Tuple[int, int]]
 
+# Primes below this bound are precomputed at import time.  Keep it small:
+# rq worker imports this module in a new process for every job, and
+# primes up to 2**10 already cover every trial divisor needed for the
+# numbers up to 2**20 sent by the polling client.
+SMALL_PRIME_LIMIT = 1 << 10
+
 
 def compute_product(factorization: Factorization) -> int:
     return prod(pow(b, e) for (b, e) in factorization)
 
 
+def sieve_of_eratosthenes(limit: int) -> bytearray:
+    '''
+    Return a table whose n-th entry is 1 if n is prime and 0 otherwise,
+    for all n below limit.
+    '''
+    flags = bytearray([1]) * limit
+    flags[:2] = bytes(min(limit, 2))
+    for p in range(2, isqrt(limit) + 1):
+        if flags[p]:
+            flags[p * p::p] = bytes(len(range(p * p, limit, p)))
+
+    return flags
+
+
+_SMALL_PRIME_FLAGS = sieve_of_eratosthenes(SMALL_PRIME_LIMIT)
+_SMALL_PRIMES = tuple(compress(range(SMALL_PRIME_LIMIT), _SMALL_PRIME_FLAGS))
+
+
+def _candidate_factors() -> Iterator[int]:
+    '''
+    Generate candidate prime factors in ascending order:  the
+    precomputed small primes, then every odd number above them.
+    '''
+    yield from _SMALL_PRIMES
+    yield from count(start=SMALL_PRIME_LIMIT + 1, step=2)
+
+
 def is_prime(n: int) -> bool:
-    def _square_is_le_n(m: int) -> bool:
-        return m * m <= n
+    if n < 2:
+        return False
+
+    elif n < SMALL_PRIME_LIMIT:
+        return bool(_SMALL_PRIME_FLAGS[n])
+
+    else:
+        def _square_is_le_n(m: int) -> bool:
+            return m * m <= n
 
-    return all(n % m != 0 for m in takewhile(_square_is_le_n, count(start=2)))
+        return all(n % m != 0 for m in takewhile(_square_is_le_n, _candidate_factors()))
 
 
 def generate_primes(start: int = 2) -> Generator[int, None, None]:
@@ -34,14 +74,29 @@ def compute_factor_exponent(b: int, n: int) -> int:
 
 
 def factorize(n: int) -> Factorization:
+    '''
+    Return the prime factorization of n as (base, exponent) pairs in
+    ascending order of base.
+    '''
     if n < 2:
         raise Exception('Can only factorize integers greater than 1.')
 
     else:
+        # Divide out each prime factor in ascending order, shrinking n as we go;
+        # whatever remains once p * p > n is itself prime.
         factorization: Factorization = []
-        while compute_product(factorization) != n:
-            primes = generate_primes(factorization[-1][0] + 1 if factorization else 2)
-            b = next(p for p in primes if is_factor(p, n))
-            factorization.append((b, compute_factor_exponent(b, n)))
+        for p in _candidate_factors():
+            if p * p > n:
+                break
+
+            if n % p == 0:
+                e = 0
+                while n % p == 0:
+                    n //= p
+                    e += 1
+                factorization.append((p, e))
+
+        if n > 1:
+            factorization.append((n, 1))
 
         return factorization
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 
-import json
 import logging
-from hashlib import sha256
-from typing import Any, Dict
-
-from flask import Flask, jsonify, request
+import os
+from hashlib import blake2b
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import Response
+from pydantic import BaseModel
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 from rq import Queue  # type: ignore
-from waitress import serve
+from starlette.concurrency import run_in_threadpool
 
 from cached_factorization import cached_factorize
 
@@ -18,58 +24,128 @@ from cached_factorization import cached_factorize
 # polled (checked & resubmitted) relatively frequently.
 DEFAULT_TTL = 5
 
+DEFAULT_REDIS_URL = 'redis://localhost'
+
+
+# Key formatters for namespaces whose params are known to be a single
+# integer.  For these, the params are put in the key directly, skipping
+# the generic JSON encoding and hashing in format_key.
+KEY_FORMATTERS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    'factorization': lambda key_params: f'factorization:{key_params["n"]:d}',
+}
+
+
+class FactorizeRequest(BaseModel):
+    number: int
+
+
+class FactorizeBatchRequest(BaseModel):
+    numbers: List[int]
+
 
 def format_key(key_namespace: str, key_params: Dict[str, Any]) -> str:
     '''
     Create a unique redis key with given namespace and params.
 
     Use the key naming convention of namespace:hash to avoid collisions
-    with Redis Queue and other systems.
+    with Redis Queue and other systems.  Namespaces registered in
+    KEY_FORMATTERS use their own formatter instead.
     '''
-    key_params_json_bytes = json.dumps(sorted(key_params.items())).encode('ascii')
-    return f'{key_namespace}:{sha256(key_params_json_bytes).hexdigest()}'
+    formatter = KEY_FORMATTERS.get(key_namespace)
+    if formatter is not None:
+        return formatter(key_params)
 
+    key_params_json_bytes = orjson.dumps(key_params, option=orjson.OPT_SORT_KEYS)
+    key_hash = blake2b(key_params_json_bytes, digest_size=16, usedforsecurity=False)
+    return f'{key_namespace}:{key_hash.hexdigest()}'
 
-def create_app(queue: Queue, cache_url: str, ttl: int = DEFAULT_TTL):
-    cache = Redis.from_url(cache_url)
-    app = Flask(__name__)
 
-    @app.route('/factorize', methods=['POST'])
+def format_status(number: int, cache_result: Optional[bytes]) -> Dict[str, Any]:
+    '''
+    Create the API response for the given number from its cached
+    result (or None if it has not been computed yet).  The cached result
+    holds both the factorization and its formatted string.
+    '''
+    if cache_result is not None:
+        return {
+            'done': True,
+            'number': number,
+            **orjson.loads(cache_result),
+        }
+    else:
+        return {
+            'done': False,
+            'number': number,
+            'factorization': None,
+            'factorization_str': None,
+        }
+
+
+def json_response(data: Any) -> Response:
+    return Response(orjson.dumps(data), media_type='application/json')
+
+
+def create_app(queue: Queue, cache_url: str, ttl: int = DEFAULT_TTL) -> FastAPI:
+    cache = AsyncRedis.from_url(cache_url)
+    app = FastAPI()
     # If you want to access the API from a web page served from another
-    # server, add the flask-cors package to requirements.txt, add
-    # "from flask_cors import cross_origin" to the imports, and
-    # uncomment the following decorator:
-    # @cross_origin()
-    def factorize():
-        # Compute task parameters from HTTP parameters
-        data = request.json
+    # server, add "from fastapi.middleware.cors import CORSMiddleware"
+    # to the imports and uncomment the following line:
+    # app.add_middleware(CORSMiddleware, allow_origins=['*'])
 
+    @app.post('/factorize')
+    async def factorize(req: FactorizeRequest):
         # Submit task
-        number = data['number']
-        cache_key = format_key('factorize', {'n': number})
-        cache_result = cache.get(cache_key)
-        if cache_result is not None:
-            factorization = json.loads(cache_result)
-            return jsonify({
-                'done': True,
-                'number': number,
-                'factorization': factorization,
-                'factorization_str': ' '.join(f'{b}^{e}' for (b, e) in sorted(factorization)),
-            })
-        else:
-            queue.enqueue(
+        number = req.number
+        cache_key = format_key('factorization', {'n': number})
+        cache_result = await cache.get(cache_key)
+        if cache_result is None:
+            # RQ uses a blocking redis client, so enqueue from a worker thread
+            await run_in_threadpool(
+                queue.enqueue,
                 cached_factorize, number, cache_key, cache_url,
                 ttl=ttl)
-            return jsonify({
-                'done': False,
-                'number': number,
-                'factorization': None,
-                'factorization_str': None,
-            })
+
+        return json_response(format_status(number, cache_result))
+
+    @app.post('/factorize_batch')
+    async def factorize_batch(req: FactorizeBatchRequest):
+        # Look up all numbers in the cache in one round trip
+        numbers = req.numbers
+        cache_keys = [format_key('factorization', {'n': number}) for number in numbers]
+        cache_results = await cache.mget(cache_keys) if cache_keys else []
+
+        # Submit tasks for all cache misses in one round trip
+        jobs_data = [
+            Queue.prepare_data(
+                cached_factorize, (number, cache_key, cache_url),
+                ttl=ttl)
+            for (number, cache_key, cache_result) in zip(numbers, cache_keys, cache_results)
+            if cache_result is None
+        ]
+        if jobs_data:
+            await run_in_threadpool(queue.enqueue_many, jobs_data)
+
+        return json_response([
+            format_status(number, cache_result)
+            for (number, cache_result) in zip(numbers, cache_results)
+        ])
 
     return app
 
 
+def create_app_from_env() -> FastAPI:
+    '''
+    Create the app configured through environment variables.  Each server
+    process calls this once, e.g.:
+      CACHE_URL=redis://cache-host uvicorn --factory --workers 4 http-server:create_app_from_env
+    '''
+    return create_app(
+        Queue(connection=Redis.from_url(os.environ.get('QUEUE_URL', DEFAULT_REDIS_URL))),
+        os.environ.get('CACHE_URL', DEFAULT_REDIS_URL),
+        ttl=int(os.environ.get('TTL', DEFAULT_TTL)))
+
+
 def main():
     from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
     parser = ArgumentParser(
@@ -79,14 +155,16 @@ def main():
                         help='Hostname/IP to listen on.')
     parser.add_argument('--port', type=int, default=8080,
                         help='TCP port to listen on.')
-    parser.add_argument('--queue-url', type=str, default='redis://localhost',
-                        help='Redis queue URL.')
-    parser.add_argument('--cache-url', type=str, default='redis://localhost',
-                        help='Redis cache URL.')
+    parser.add_argument('--queue-url', type=str, default=DEFAULT_REDIS_URL,
+                        help='Redis queue URL (use unix:///path/to/redis.sock for a local '
+                             'unix domain socket).')
+    parser.add_argument('--cache-url', type=str, default=DEFAULT_REDIS_URL,
+                        help='Redis cache URL (use unix:///path/to/redis.sock for a local '
+                             'unix domain socket).')
     parser.add_argument('--ttl', type=int, default=DEFAULT_TTL,
                         help='Time-to-live (in seconds) of jobs in queue before they are expired.')
-    parser.add_argument('--threads', type=int, default=1,
-                        help='Number of threads to use for HTTP server.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of HTTP server processes.')
     parser.add_argument('--log-level',
                         choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
                         default='INFO',
@@ -97,9 +175,14 @@ def main():
         format='[%(asctime)s] %(levelname)s [%(name)s] %(message)s',
         level=args.log_level)
 
-    queue = Queue(connection=Redis.from_url(args.queue_url))
-    app = create_app(queue, args.cache_url, ttl=args.ttl)
-    serve(app, host=args.host, port=args.port, threads=args.threads)
+    # Each server process creates its own app with create_app_from_env,
+    # which reads its configuration from the environment
+    os.environ.update(QUEUE_URL=args.queue_url, CACHE_URL=args.cache_url, TTL=str(args.ttl))
+    script_path = Path(__file__).resolve()
+    uvicorn.run(f'{script_path.stem}:create_app_from_env', factory=True,
+                app_dir=str(script_path.parent), host=args.host, port=args.port,
+                workers=args.workers, loop='uvloop', http='httptools',
+                log_level=args.log_level.lower())
 
 
 if __name__ == '__main__':
@@ -2,15 +2,23 @@ import random
 import requests
 import time
 
+from requests.adapters import HTTPAdapter
+
+
+# Shared by all requests in the process so connections are kept alive and reused
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
 
 def poll_factorize(url: str):
     done = False
     numbers = [random.randint(2, 2**20) for _ in range(20)]
     while not done:
         done = True
-        for n in numbers:
-            status = requests.post(url, json={'number': n}).json()
-
+        statuses = session.post(url, json={'numbers': numbers}).json()
+        for status in statuses:
+            n = status['number']
             if status['done']:
                 print(f'{n:7d} =', status['factorization_str'])
             else:
@@ -28,7 +36,7 @@ def main():
     parser = ArgumentParser(
         description='Submit twenty large numbers to be factorized and poll the server until they are done',
     )
-    parser.add_argument('url', help='Factorize endpoint URL')
+    parser.add_argument('url', help='Batch factorize endpoint URL')
     args = parser.parse_args()
 
     poll_factorize(args.url)
@@ -1,19 +1,48 @@
 #!/usr/bin/env python3
 
-import json
 import logging
 from functools import wraps
-from time import sleep
-from typing import Any, Callable, Dict, List, Optional, NamedTuple, Tuple, Union
+from time import monotonic
+from typing import Any, Callable, Dict, Iterable, List, Optional, NamedTuple, Set, Tuple, Union
 
+import msgspec
+import orjson
 from redis import Redis
-from redis.exceptions import LockError, LockNotOwnedError
-from redis.lock import Lock
 
 
-JSONOrderedDict = List[Tuple[str, Any]]
 JSONValue = Union[Dict, List, str, int, float, bool, None]
 
+# Maximum age (in seconds) of the load reported by submit_task
+DEFAULT_LOAD_TTL = 0.25
+
+
+# Compact key formats for known key types, used instead of the generic
+# JSON format.  KEY_FORMATTERS produce the whole key; KEY_PARSERS invert
+# the part after the "<key type>:" prefix.
+KEY_FORMATTERS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    'factorization': lambda key_params: f'factorization:{key_params["number"]:d}',
+}
+KEY_PARSERS: Dict[str, Callable[[str], Dict[str, Any]]] = {
+    'factorization': lambda key_params_str: {'number': int(key_params_str)},
+}
+
+
+# Lua script adding (or refreshing) task ARGV[1] in sorted set KEYS[1],
+# scored by the server's current time, in a single round trip
+SUBMIT_ITEM_SCRIPT = '''
+redis.call('ZADD', KEYS[1], redis.call('TIME')[1], ARGV[1])
+'''
+
+
+# Lua script removing tasks submitted more than ARGV[1] seconds ago
+# from each of the sorted sets in KEYS, in a single round trip
+EXPIRE_ITEMS_SCRIPT = '''
+local cutoff = tonumber(redis.call('TIME')[1]) - tonumber(ARGV[1])
+for _, key_type in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key_type, 0, cutoff)
+end
+'''
+
 
 class TaskStatus(NamedTuple):
     done: bool
@@ -21,14 +50,21 @@ class TaskStatus(NamedTuple):
     load: int
 
 
-def format_key(key_type: str, key_params: Dict[str, Any]) -> str:
-    key_params_list = sorted(key_params.items())
-    return json.dumps([key_type, key_params_list])
+def format_key(key_type: str, key_params: Dict[str, Any]) -> bytes:
+    formatter = KEY_FORMATTERS.get(key_type)
+    if formatter is not None:
+        return formatter(key_params).encode('utf-8')
+    else:
+        return orjson.dumps([key_type, key_params], option=orjson.OPT_SORT_KEYS)
 
 
-def parse_key(key: str) -> Tuple[str, Dict[str, Any]]:
-    (key_type, key_params_list) = json.loads(key)
-    return (key_type, dict(key_params_list))
+def parse_key(key: bytes) -> Tuple[str, Dict[str, Any]]:
+    if key.startswith(b'['):
+        (key_type, key_params) = orjson.loads(key)
+        return (key_type, key_params)
+    else:
+        (key_type, key_params_str) = key.decode('utf-8').split(':', 1)
+        return (key_type, KEY_PARSERS[key_type](key_params_str))
 
 
 def _star_wrap(handler: Callable[..., JSONValue]) -> Callable[[Dict[str, Any]], JSONValue]:
@@ -40,17 +76,57 @@ def _star_wrap(handler: Callable[..., JSONValue]) -> Callable[[Dict[str, Any]],
 
 
 class TaskManager:
+    '''
+    Task queue with one redis sorted set per key type.  Submitting a task
+    adds (or refreshes) its key in the sorted set, scored by submission
+    time; workers block on BZPOPMAX, so the most recently requested task
+    is processed first and tasks not re-submitted within input_expire
+    seconds are dropped.
+
+    The load reported by submit_task is the number of queued tasks of all
+    key_types.  Pass every key type the workers handle, so all managers
+    on the queue report the same load; key types submitted through this
+    manager are added automatically.
+    '''
     input_cache: Redis
     output_cache: Redis
     input_expire: int
     sleep_interval: float
+    load_ttl: float
 
     def __init__(self, input_cache: Redis, output_cache: Redis,
-                 input_expire: int = 60, sleep_interval: float = 1.):
+                 input_expire: int = 60, sleep_interval: float = 1.,
+                 load_ttl: float = DEFAULT_LOAD_TTL, key_types: Iterable[str] = ()):
         self.input_cache = input_cache
         self.output_cache = output_cache
         self.input_expire = input_expire
         self.sleep_interval = sleep_interval
+        self.load_ttl = load_ttl
+        self._submit_item_script = input_cache.register_script(SUBMIT_ITEM_SCRIPT)
+        self._expire_items_script = input_cache.register_script(EXPIRE_ITEMS_SCRIPT)
+        # Key types whose queued tasks count towards the load
+        self._key_types: Set[str] = set(key_types)
+        # Last measured load and the (monotonic) time it was measured
+        self._load_cache = (0, float('-inf'))
+        # Task values are stored in the output cache as MessagePack
+        self._enc = msgspec.msgpack.Encoder()
+        self._dec = msgspec.msgpack.Decoder()
+
+    @classmethod
+    def from_url(cls, input_url: str, output_url: Optional[str] = None,
+                 max_connections: Optional[int] = None, **kwargs) -> 'TaskManager':
+        '''
+        Create a task manager connected to the given redis URLs.  If the
+        output URL is omitted or equal to the input URL, both caches share
+        one client (and connection pool).
+        '''
+        input_cache = Redis.from_url(input_url, max_connections=max_connections)
+        if output_url is None or output_url == input_url:
+            output_cache = input_cache
+        else:
+            output_cache = Redis.from_url(output_url, max_connections=max_connections)
+
+        return cls(input_cache, output_cache, **kwargs)
 
     def process_tasks_star(self, handlers: Dict[str, Callable[..., JSONValue]]):
         return self.process_tasks(dict(
@@ -60,25 +136,28 @@ class TaskManager:
         ))
 
     def process_tasks(self, handlers: Dict[str, Callable[[Dict[str, Any]], JSONValue]]):
+        key_types = list(handlers.keys())
+        self._key_types.update(key_types)
+
         while True:
             try:
-                key = self.input_cache.randomkey()
-                if key is not None:
-                    (key_type, key_params) = parse_key(key)
+                self._expire_items(key_types)
+
+                logging.debug(f'Popping new task from {key_types}...')
+                pop_result = self.input_cache.bzpopmax(key_types, timeout=self.sleep_interval)
+                if pop_result is not None:
+                    (key_type_bytes, key, score) = pop_result
+                    key_type = key_type_bytes.decode('utf-8')
                     logging.debug(f'Popped task with key type {key_type}.')
-                    handler = handlers.get(key_type)
-                    if handler is not None:
-                        logging.debug('Running task handler...')
-                        value = handler(key_params)
-                        logging.debug('Storing task result in output cache.')
-                        self.output_cache.set(key, json.dumps(value))
-                        self.input_cache.delete(key)
-                    else:
-                        raise Exception(
-                            f'Sampled key has unrecognized type {key_type}')
-
-                else:
-                    sleep(self.sleep_interval)
+                    key_params = parse_key(key)[1]
+                    handler = handlers[key_type]
+
+                    # BZPOPMAX removed the task, so no other worker can claim it
+                    logging.debug('Running task handler...')
+                    value = handler(key_params)
+
+                    logging.debug('Storing task result in output cache.')
+                    self.output_cache.set(key, self._enc.encode(value))
 
             except Exception:
                 logging.exception('Caught exception while handling task')
@@ -89,97 +168,41 @@ class TaskManager:
         if value_str is not None:
             return TaskStatus(
                 done=True,
-                value=json.loads(value_str),
-                load=self._get_load(),
+                value=self._dec.decode(value_str),
+                load=self._get_cached_load(),
             )
         else:
             self._update_input_key(key_type, key)
             return TaskStatus(
                 done=False,
                 value=None,
-                load=self._get_load(),
+                load=self._get_cached_load(),
             )
 
-    def _update_input_key(self, key_type: str, key: str):
-        self.input_cache.set(key, '1', ex=self.input_expire)
-
-    def _get_load(self) -> int:
-        return self.input_cache.dbsize()
-
-
-class DistributedTaskManager(TaskManager):
-    lock: Optional[Lock]
-    pop_timeout: int
-
-    def __init__(self, input_cache: Redis, output_cache: Redis,
-                 input_expire: int = 60, lock: Optional[Lock] = None,
-                 pop_timeout: int = 5):
-        super().__init__(input_cache, output_cache,
-                         input_expire=input_expire, sleep_interval=0)
-        self.lock = lock
-        self.pop_timeout = pop_timeout
-
-    def process_tasks(self, handlers: Dict[str, Callable[[Dict[str, Any]], JSONValue]]):
-        key_types = list(handlers.keys())
-
-        while True:
-            try:
-                for key_type in key_types:
-                    self._expire_items(key_type)
-
-                logging.debug(f'Popping new task from {key_types}...')
-                pop_result = self.input_cache.bzpopmax(key_types, timeout=self.pop_timeout)
-                if pop_result is not None:
-                    (key_type_bytes, key, score) = pop_result
-                    key_type = key_type_bytes.decode('utf-8')
-                    logging.debug(f'Popped task with key type {key_type}.')
-                    key_params = parse_key(key)[1]
-                    handler = handlers[key_type]
-
-                    if self.lock is not None:
-                        logging.debug('Acquiring lock...')
-                        with self.lock:
-                            logging.debug('Lock acquired; running task handler...')
-                            value = handler(key_params)
+    def _update_input_key(self, key_type: str, key: bytes):
+        self._key_types.add(key_type)
+        self._submit_item_script(keys=[key_type], args=[key])
+
+    def _get_cached_load(self) -> int:
+        '''
+        Return the load, re-measuring it only if the last measurement is
+        older than load_ttl seconds.
+        '''
+        now = monotonic()
+        (load, measured_at) = self._load_cache
+        if now - measured_at > self.load_ttl:
+            load = self._get_load()
+            self._load_cache = (load, now)
 
-                            # Store output within lock context in case the lock has already been
-                            # released:  Exiting the context will raise an exception, but we still
-                            # successfully computed the task output and don't want to waste it.
-                            logging.debug('Storing task result in output cache.')
-                            self.output_cache.set(key, json.dumps(value))
-
-                    else:
-                        logging.debug('Running task handler...')
-                        value = handler(key_params)
-
-                        logging.debug('Storing task result in output cache.')
-                        self.output_cache.set(key, json.dumps(value))
-
-            except LockNotOwnedError:
-                logging.warning('Lock has new owner; could not release.')
-
-            except LockError as ex:
-                raise ex
-
-            except Exception:
-                logging.exception('Caught exception while handling task')
-
-    def _update_input_key(self, key_type: str, key: str):
-        self.input_cache.zadd(key_type, {key: self._get_time()})
+        return load
 
     def _get_load(self) -> int:
-        load = 0
-        for k in self.input_cache.keys():
-            try:
-                load += self.input_cache.zcard(k)
-            except Exception:
-                pass  # Skip non-sorted-set keys
-
-        return load
+        pipe = self.input_cache.pipeline(transaction=False)
+        for key_type in self._key_types:
+            pipe.zcard(key_type)
 
-    def _get_time(self) -> int:
-        return self.input_cache.time()[0]
+        return sum(pipe.execute())
 
-    def _expire_items(self, key_type: str):
-        logging.debug(f'Expiring items in {key_type} older than {self.input_expire} seconds...')
-        self.input_cache.zremrangebyscore(key_type, 0, self._get_time() - self.input_expire)
+    def _expire_items(self, key_types: List[str]):
+        logging.debug(f'Expiring items in {key_types} older than {self.input_expire} seconds...')
+        self._expire_items_script(keys=key_types, args=[self.input_expire])
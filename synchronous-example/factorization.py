@@ -1,21 +1,98 @@
 #!/usr/bin/env python3
 
-from itertools import count, takewhile
-from math import prod
-from typing import Generator, List, Tuple
+import os
+from concurrent.futures import Executor
+from itertools import compress, count, takewhile
+from math import isqrt, prod
+from typing import Generator, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from numba import config as numba_config  # type: ignore
+    from numba import get_num_threads, njit, prange, set_num_threads  # type: ignore
+    HAVE_NUMBA = True
+    # Most threads numba can run a kernel on (NUMBA_NUM_THREADS, which
+    # defaults to the number of CPU cores)
+    MAX_THREADS: int = numba_config.NUMBA_NUM_THREADS  # type: ignore
+except ImportError:
+    # Without numba, the kernels below are plain Python functions; they
+    # are only used by the numba backend, so they never run
+    HAVE_NUMBA = False
+    MAX_THREADS = os.cpu_count() or 1
+    prange = range  # type: ignore
+
+    def njit(*args, **kwargs):  # type: ignore
+        return lambda f: f
 
 Factorization = List[Tuple[int, int]]
 
+# Factorization backends:  "numba" runs compiled int64 kernels; "python"
+# runs trial division on plain ints, which PyPy's JIT compiles well
+BACKENDS = ('numba', 'python')
+
+# Primes below this bound are precomputed at import time
+SMALL_PRIME_LIMIT = 1 << 20
+
+# Largest number factorized by the compiled kernel; p * p cannot
+# overflow int64 for any trial divisor p it needs below this bound
+MAX_KERNEL_NUMBER = 1 << 62
+
+# Maximum number of distinct prime factors of a number that fits in
+# int64 (the product of the first 16 primes exceeds 2**63)
+MAX_FACTORS = 16
+
+# Smallest number factorize_array_sharded splits across threads; smaller
+# numbers are factorized faster than the threads can be coordinated
+MIN_SHARDED_NUMBER = 1 << 50
+
+# Factors up to this bound are always searched for on the calling thread
+SMALL_FACTOR_BOUND = 1 << 16
+
 
 def compute_product(factorization: Factorization) -> int:
     return prod(pow(b, e) for (b, e) in factorization)
 
 
+def sieve_of_eratosthenes(limit: int) -> bytearray:
+    '''
+    Return a table whose n-th entry is 1 if n is prime and 0 otherwise,
+    for all n below limit.
+    '''
+    flags = bytearray([1]) * limit
+    flags[:2] = bytes(min(limit, 2))
+    for p in range(2, isqrt(limit) + 1):
+        if flags[p]:
+            flags[p * p::p] = bytes(len(range(p * p, limit, p)))
+
+    return flags
+
+
+_SMALL_PRIME_FLAGS = sieve_of_eratosthenes(SMALL_PRIME_LIMIT)
+_SMALL_PRIMES = tuple(compress(range(SMALL_PRIME_LIMIT), _SMALL_PRIME_FLAGS))
+
+
+def _candidate_factors() -> Iterator[int]:
+    '''
+    Generate candidate prime factors in ascending order:  the
+    precomputed small primes, then every odd number above them.
+    '''
+    yield from _SMALL_PRIMES
+    yield from count(start=SMALL_PRIME_LIMIT + 1, step=2)
+
+
 def is_prime(n: int) -> bool:
-    def _square_is_le_n(m: int) -> bool:
-        return m * m <= n
+    if n < 2:
+        return False
 
-    return all(n % m != 0 for m in takewhile(_square_is_le_n, count(start=2)))
+    elif n < SMALL_PRIME_LIMIT:
+        return bool(_SMALL_PRIME_FLAGS[n])
+
+    else:
+        def _square_is_le_n(m: int) -> bool:
+            return m * m <= n
+
+        return all(n % m != 0 for m in takewhile(_square_is_le_n, _candidate_factors()))
 
 
 def generate_primes(start: int = 2) -> Generator[int, None, None]:
@@ -33,15 +110,283 @@ def compute_factor_exponent(b: int, n: int) -> int:
     return list(takewhile(_power_is_factor, count(start=0)))[-1]
 
 
+# Distances between consecutive numbers coprime to 2, 3, and 5, starting
+# from 7 (i.e., 7, 11, 13, 17, 19, 23, 29, 31, 37, ...)
+_WHEEL_GAPS = np.array([4, 2, 4, 2, 4, 6, 2, 6], dtype=np.int64)
+
+
+@njit(cache=True)
+def _divide_out(n: int, p: int, bases: np.ndarray, exps: np.ndarray,
+                k: int) -> Tuple[int, int]:
+    # If p divides n, write p and its exponent to position k of bases and
+    # exps; return n with all factors of p removed and the number of
+    # factors written
+    if n % p == 0:
+        e = 0
+        while n % p == 0:
+            n //= p
+            e += 1
+        bases[k] = p
+        exps[k] = e
+        k += 1
+
+    return (n, k)
+
+
+@njit(cache=True)
+def _factorize_kernel(n: int, bases: np.ndarray, exps: np.ndarray) -> int:
+    # Write the prime factors of n and their exponents to bases and exps,
+    # in ascending order of base, and return the number of factors written.
+    # Trial division skips multiples of 2, 3, and 5 after dividing those
+    # out.  Callers rely on the ordering and never sort the output.
+    k = 0
+    (n, k) = _divide_out(n, 2, bases, exps, k)
+    (n, k) = _divide_out(n, 3, bases, exps, k)
+    (n, k) = _divide_out(n, 5, bases, exps, k)
+
+    p = 7
+    i = 0
+    while p * p <= n:
+        # Test divisibility inline, keeping the loop to integer arithmetic
+        # on n and p; only call out (and touch the arrays) for actual factors
+        if n % p == 0:
+            (n, k) = _divide_out(n, p, bases, exps, k)
+        p += _WHEEL_GAPS[i]
+        i = (i + 1) & 7
+
+    if n > 1:
+        bases[k] = n
+        exps[k] = 1
+        k += 1
+
+    return k
+
+
+def _factorize_python(n: int) -> Factorization:
+    # Divide out each prime factor in ascending order, shrinking n as we go;
+    # whatever remains once p * p > n is itself prime.  Only plain ints are
+    # used, so this loop stays fast under PyPy.
+    factorization: Factorization = []
+    for p in _candidate_factors():
+        if p * p > n:
+            break
+
+        if n % p == 0:
+            e = 0
+            while n % p == 0:
+                n //= p
+                e += 1
+            factorization.append((p, e))
+
+    if n > 1:
+        factorization.append((n, 1))
+
+    return factorization
+
+
+_backend = 'numba' if HAVE_NUMBA else 'python'
+
+
+def get_backend() -> str:
+    return _backend
+
+
+def set_backend(backend: str):
+    '''
+    Select the backend used by factorize, factorize_array, and
+    factorize_batch for the whole process (one of BACKENDS).
+    '''
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend {backend!r}; expected one of {BACKENDS}.')
+    elif backend == 'numba' and not HAVE_NUMBA:
+        raise ValueError('The numba backend requires the numba package.')
+
+    _backend = backend
+
+
+def factorize_array(n: int) -> np.ndarray:
+    '''
+    Return the prime factorization of n (at most MAX_KERNEL_NUMBER) as a
+    read-only (k, 2) int64 array of (base, exponent) rows in ascending
+    order of base.  Unlike factorize, no Python objects are created per
+    factor.
+    '''
+    if not 2 <= n <= MAX_KERNEL_NUMBER:
+        raise Exception(f'Can only factorize integers between 2 and {MAX_KERNEL_NUMBER:d}.')
+
+    elif _backend == 'python':
+        factorization = np.array(_factorize_python(n), dtype=np.int64)
+        factorization.flags.writeable = False
+        return factorization
+
+    out = np.empty((MAX_FACTORS, 2), dtype=np.int64)
+    k = _factorize_kernel(n, out[:, 0], out[:, 1])
+    # The first k rows of out are contiguous, so they can be serialized as is
+    factorization = out[:k]
+    factorization.flags.writeable = False
+    return factorization
+
+
+@njit(nogil=True, cache=True)
+def factor_in_range(n: int, lo: int, hi: int) -> int:
+    '''
+    Return the smallest factor of n between lo and hi (inclusive), or 0
+    if there is none, assuming n has no prime factors below lo (so that
+    factor is prime).  Releases the GIL, so several ranges can be
+    searched by Python threads in parallel.
+    '''
+    for p in (2, 3, 5):
+        if lo <= p <= hi and n % p == 0:
+            return p
+
+    # Skip multiples of 2, 3, and 5 as _factorize_kernel does, starting
+    # from the first wheel position at or above lo
+    p = 7 + 30 * max(0, (lo - 7) // 30)
+    i = 0
+    while p < lo:
+        p += _WHEEL_GAPS[i]
+        i = (i + 1) & 7
+
+    while p <= hi:
+        if n % p == 0:
+            return p
+        p += _WHEEL_GAPS[i]
+        i = (i + 1) & 7
+
+    return 0
+
+
+def _find_factor_sharded(n: int, lo: int, hi: int, executor: Executor, num_shards: int) -> int:
+    # Split [lo, hi] into num_shards ranges searched in parallel; check the
+    # results in order so the factor returned is the smallest.  Shards
+    # can't be interrupted once running, so once a factor is found only
+    # those not yet started are cancelled.
+    if lo > hi:
+        return 0
+
+    shard_size = -(-(hi - lo + 1) // num_shards)
+    futures = [
+        executor.submit(factor_in_range, n, start, min(start + shard_size - 1, hi))
+        for start in range(lo, hi + 1, shard_size)
+    ]
+    try:
+        for future in futures:
+            d = future.result()
+            if d != 0:
+                return d
+
+        return 0
+
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def factorize_array_sharded(n: int, executor: Executor, num_shards: int) -> np.ndarray:
+    '''
+    Like factorize_array, but for large n, split the search for each
+    prime factor above SMALL_FACTOR_BOUND into num_shards ranges that
+    the executor's threads search in parallel.
+    '''
+    if n < MIN_SHARDED_NUMBER or n > MAX_KERNEL_NUMBER or _backend == 'python':
+        return factorize_array(n)
+
+    # The smallest factor of n above the previous prime factor is the next
+    # prime factor; once there is none up to the square root of the
+    # remaining n, that is itself prime
+    factorization: Factorization = []
+    lo = 2
+    while n > 1:
+        hi = isqrt(n)
+        d = factor_in_range(n, lo, min(hi, SMALL_FACTOR_BOUND))
+        if d == 0 and hi > SMALL_FACTOR_BOUND:
+            d = _find_factor_sharded(
+                n, max(lo, SMALL_FACTOR_BOUND + 1), hi, executor, num_shards)
+
+        if d == 0:
+            factorization.append((n, 1))
+            break
+
+        e = 0
+        while n % d == 0:
+            n //= d
+            e += 1
+        factorization.append((d, e))
+        lo = d + 1
+
+    factorization_array = np.array(factorization, dtype=np.int64)
+    factorization_array.flags.writeable = False
+    return factorization_array
+
+
 def factorize(n: int) -> Factorization:
+    '''
+    Return the prime factorization of n as (base, exponent) pairs in
+    ascending order of base.
+    '''
     if n < 2:
         raise Exception('Can only factorize integers greater than 1.')
 
+    elif n <= MAX_KERNEL_NUMBER and _backend == 'numba':
+        bases = np.empty(MAX_FACTORS, dtype=np.int64)
+        exps = np.empty(MAX_FACTORS, dtype=np.int64)
+        k = _factorize_kernel(n, bases, exps)
+        return list(zip(bases[:k].tolist(), exps[:k].tolist()))
+
     else:
-        factorization: Factorization = []
-        while compute_product(factorization) != n:
-            primes = generate_primes(factorization[-1][0] + 1 if factorization else 2)
-            b = next(p for p in primes if is_factor(p, n))
-            factorization.append((b, compute_factor_exponent(b, n)))
+        return _factorize_python(n)
 
-        return factorization
+
+@njit(parallel=True, cache=True)
+def _factorize_batch_kernel(numbers: np.ndarray, out_bases: np.ndarray, out_exps: np.ndarray,
+                            out_lens: np.ndarray):
+    # Factorize each of numbers with _factorize_kernel, writing the prime
+    # factors of numbers[i] and their exponents to out_bases[i] and
+    # out_exps[i] and their count to out_lens[i].  The numbers are split
+    # among numba's worker threads, which run without the GIL.
+    for i in prange(numbers.size):
+        out_lens[i] = _factorize_kernel(numbers[i], out_bases[i], out_exps[i])
+
+
+def factorize_batch(numbers: Sequence[int],
+                    num_threads: Optional[int] = None) -> List[Factorization]:
+    '''
+    Factorize several numbers at once, running the compiled kernel over
+    all of them in parallel in a single call.  As with factorize, each
+    factorization is in ascending order of base.
+
+    If num_threads is given, use at most that many threads, clamped to
+    between 1 and MAX_THREADS; otherwise use numba's current setting for
+    the calling thread.  The python backend factorizes the numbers one at
+    a time and ignores num_threads.
+    '''
+    if any(n < 2 for n in numbers):
+        raise Exception('Can only factorize integers greater than 1.')
+
+    elif _backend == 'python':
+        return [_factorize_python(n) for n in numbers]
+
+    # Numbers too large for the kernel are passed to factorize one at a
+    # time; the kernel gets 1 (which has no factors) in their place
+    kernel_numbers = np.array(
+        [n if n <= MAX_KERNEL_NUMBER else 1 for n in numbers], dtype=np.int64)
+    out_bases = np.empty((len(numbers), MAX_FACTORS), dtype=np.int64)
+    out_exps = np.empty((len(numbers), MAX_FACTORS), dtype=np.int64)
+    out_lens = np.empty(len(numbers), dtype=np.int64)
+    # The thread count set by numba is local to the calling thread, so
+    # set it (and restore it) around each call; numba can't run kernels
+    # on more threads than it started with
+    prev_num_threads = get_num_threads()
+    if num_threads is not None:
+        set_num_threads(max(1, min(num_threads, MAX_THREADS)))
+    try:
+        _factorize_batch_kernel(kernel_numbers, out_bases, out_exps, out_lens)
+    finally:
+        set_num_threads(prev_num_threads)
+
+    return [
+        factorize(n) if n > MAX_KERNEL_NUMBER else list(zip(bases[:k], exps[:k]))
+        for (n, bases, exps, k)
+        in zip(numbers, out_bases.tolist(), out_exps.tolist(), out_lens.tolist())
+    ]
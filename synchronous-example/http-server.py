@@ -1,50 +1,155 @@
 #!/usr/bin/env python3
 
 import logging
-from typing import Any, Dict
+import os
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
-from flask import Flask, jsonify, request
-from waitress import serve
+import orjson
+import uvicorn
+from asgiref.wsgi import WsgiToAsgi
 
-from factorization import factorize
+from factorization import BACKENDS, MAX_KERNEL_NUMBER, get_backend
+from worker import Worker
 
 
-class Worker:
-    def __init__(self):
-        logging.info('Initializing...')
-        logging.info('Done.')
+LOG_FORMAT = '[%(asctime)s] %(levelname)s [%(name)s] %(message)s'
 
-    def do_task(self, number: int) -> Dict[str, Any]:
-        # Do the heavy lifting here
-        logging.info(f'Finding prime factorization of {number}...')
-        factorization = factorize(number)
-        logging.info('Done.')
+INVALID_NUMBER_MESSAGE = f'Numbers must be integers between 2 and {MAX_KERNEL_NUMBER:d}.'
 
-        return {
-            'number': number,
-            'factorization': factorization,
-            'factorization_str': ' '.join(f'{b}^{e}' for (b, e) in sorted(factorization))
-        }
+# WSGI application:  takes the request environment and start_response
+# callback and returns the response body
+WSGIApp = Callable[[Dict[str, Any], Callable[..., Any]], Iterable[bytes]]
 
+# Handler for one route:  takes the request environment and returns the
+# data to send back as JSON
+Handler = Callable[[Dict[str, Any]], Any]
 
-def create_app():
-    app = Flask(__name__)
-    worker = Worker()
+# Response headers as (name, value) pairs
+Headers = Sequence[Tuple[str, str]]
 
-    @app.route('/factorize', methods=['POST'])
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: Optional[str] = None,
+                 headers: Headers = ()):
+        super().__init__(message or status.description)
+        self.status = status
+        self.message = message or status.description
+        self.headers = headers
+
+
+def status_line(status: HTTPStatus) -> str:
+    return f'{status.value:d} {status.phrase}'
+
+
+def json_response(start_response: Callable[..., Any], status: HTTPStatus,
+                  data: Any, headers: Headers = ()) -> List[bytes]:
+    body = orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
     # If you want to access the API from a web page served from another
-    # server, add the flask-cors package to requirements.txt, add
-    # "from flask_cors import cross_origin" to the imports, and
-    # uncomment the following decorator:
-    # @cross_origin()
-    def factorize():
-        input_data = request.json
-        output_data = worker.do_task(input_data['number'])
-        return jsonify(output_data)
+    # server, add ('Access-Control-Allow-Origin', '*') to these headers
+    # (and answer OPTIONS requests for the routes below)
+    start_response(status_line(status), [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(body))),
+        *headers,
+    ])
+    return [body]
+
+
+def read_json_object(environ: Dict[str, Any], required_key: str) -> Dict[str, Any]:
+    '''
+    Parse the request body as a JSON object containing the given key,
+    raising an HTTPError (400 Bad Request) if it is not one.
+    '''
+    try:
+        content_length = int(environ.get('CONTENT_LENGTH') or 0)
+        input_data = orjson.loads(environ['wsgi.input'].read(content_length))
+    except (ValueError, orjson.JSONDecodeError):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'Request body must be a JSON object.')
+
+    if not isinstance(input_data, dict) or required_key not in input_data:
+        raise HTTPError(HTTPStatus.BAD_REQUEST,
+                        f'Request body must be a JSON object with key "{required_key}".')
+
+    return input_data
+
+
+def is_valid_number(number: Any) -> bool:
+    # Only accept numbers the compiled int64 kernel can factorize, so
+    # requests never fall back to (much slower) arbitrary-precision code
+    return (isinstance(number, int) and not isinstance(number, bool) and
+            2 <= number <= MAX_KERNEL_NUMBER)
+
+
+def create_app(num_threads: Optional[int] = None, backend: Optional[str] = None) -> WSGIApp:
+    worker = Worker(num_threads, backend)
+    # Look up the handlers' callees once here rather than on every request
+    do_task = worker.do_task
+    do_task_batch = worker.do_task_batch
+    respond = json_response
+
+    def factorize(environ: Dict[str, Any]) -> Any:
+        input_data = read_json_object(environ, 'number')
+        if not is_valid_number(input_data['number']):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, INVALID_NUMBER_MESSAGE)
+        return do_task(input_data['number'])
+
+    def factorize_batch(environ: Dict[str, Any]) -> Any:
+        input_data = read_json_object(environ, 'numbers')
+        if not (isinstance(input_data['numbers'], list) and
+                all(is_valid_number(number) for number in input_data['numbers'])):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, INVALID_NUMBER_MESSAGE)
+        return do_task_batch(input_data['numbers'])
+
+    def cache_stats(environ: Dict[str, Any]) -> Any:
+        return worker.cache_stats()
+
+    # Handlers by path, then by request method
+    routes: Dict[str, Dict[str, Handler]] = {
+        '/factorize': {'POST': factorize},
+        '/factorize_batch': {'POST': factorize_batch},
+        '/cache_stats': {'GET': cache_stats},
+    }
+
+    def app(environ: Dict[str, Any], start_response: Callable[..., Any]) -> List[bytes]:
+        try:
+            handlers = routes.get(environ['PATH_INFO'])
+            if handlers is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND)
+
+            handler = handlers.get(environ['REQUEST_METHOD'])
+            if handler is None:
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED,
+                                headers=[('Allow', ', '.join(handlers))])
+
+            return respond(start_response, HTTPStatus.OK, handler(environ))
+
+        except HTTPError as ex:
+            return respond(start_response, ex.status, {'error': ex.message}, ex.headers)
 
     return app
 
 
+def create_asgi_app() -> WsgiToAsgi:
+    '''
+    Create the app configured through environment variables, wrapped for
+    an ASGI server.  Each server process calls this once, e.g.:
+      NUM_THREADS=2 BACKEND=numba uvicorn --factory --workers 4 http-server:create_asgi_app
+    '''
+    logging.basicConfig(format=LOG_FORMAT, level=os.environ.get('LOG_LEVEL', 'WARNING'))
+    num_threads = os.environ.get('NUM_THREADS')
+    return WsgiToAsgi(create_app(int(num_threads) if num_threads else None,
+                                 os.environ.get('BACKEND')))
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise ValueError(f'{value} is not a positive integer')
+    return number
+
+
 def main():
     from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
     parser = ArgumentParser(
@@ -54,18 +159,41 @@ def main():
                         help='Hostname/IP to listen on.')
     parser.add_argument('--port', type=int, default=8080,
                         help='TCP port to listen on.')
+    parser.add_argument('--workers', type=positive_int, default=1,
+                        help='Number of server processes.  Tasks are CPU-bound, so use more '
+                             'than one process (up to the number of cores) to serve requests '
+                             'in parallel.')
+    parser.add_argument('--threads', type=positive_int,
+                        help='Number of threads each server process uses to factorize a batch '
+                             'of numbers (default: the number of CPU cores divided by the '
+                             'number of processes).')
+    parser.add_argument('--backend', choices=BACKENDS, default=get_backend(),
+                        help='Factorization backend:  numba runs compiled kernels; python runs '
+                             'plain Python trial division (use it when numba is unavailable, '
+                             'e.g. under PyPy).')
     parser.add_argument('--log-level',
                         choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
-                        default='INFO',
-                        help='Minimum severity level of log messages to show')
+                        default='WARNING',
+                        help='Minimum severity level of log messages to show.  INFO logs '
+                             'every request.')
     args = parser.parse_args()
 
-    logging.basicConfig(
-        format='[%(asctime)s] %(levelname)s [%(name)s] %(message)s',
-        level=args.log_level)
-
-    app = create_app()
-    serve(app, host=args.host, port=args.port, threads=1)
+    logging.basicConfig(format=LOG_FORMAT, level=args.log_level)
+
+    # Split the CPU cores among the server processes by default
+    num_threads = args.threads
+    if num_threads is None:
+        num_threads = max(1, (os.cpu_count() or 1) // args.workers)
+
+    # Each server process creates its own app (and Worker) with
+    # create_asgi_app, which reads its configuration from the environment
+    os.environ.update(NUM_THREADS=str(num_threads), BACKEND=args.backend,
+                      LOG_LEVEL=args.log_level)
+    script_path = Path(__file__).resolve()
+    uvicorn.run(f'{script_path.stem}:create_asgi_app', factory=True,
+                app_dir=str(script_path.parent), host=args.host, port=args.port,
+                workers=args.workers, loop='uvloop', http='httptools',
+                log_level=args.log_level.lower())
 
 
 if __name__ == '__main__':
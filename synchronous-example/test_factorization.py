@@ -0,0 +1,121 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from factorization import (
+    HAVE_NUMBA, MAX_THREADS, Factorization, factor_in_range, factorize, factorize_array,
+    factorize_array_sharded, factorize_batch, get_backend, set_backend,
+)
+
+
+# Primes just below 2**61
+LARGE_PRIMES = [2305843009213693907, 2305843009213693921, 2305843009213693951]
+
+# Semiprimes above MIN_SHARDED_NUMBER with a small factor, whose
+# factorizations are quick to check with every backend
+SMALL_FACTOR_SEMIPRIMES = [1048573 * 34359738421, 1048573 * (2**31 - 1)]
+
+# Semiprimes above MIN_SHARDED_NUMBER with two large factors
+LARGE_FACTOR_SEMIPRIMES = [33554393 * 67108879, (2**31 - 1) * (2**31 - 19)]
+
+SMALL_NUMBERS = (
+    list(range(2, 5000)) +
+    random.Random(0).sample(range(1 << 39, 1 << 40), 30) +
+    [2**62, 3**39, 2 * 3 * 5 * 7 * 11 * 13 * 17 * 19 * 23 * 29 * 31 * 37 * 41 * 43 * 47] +
+    SMALL_FACTOR_SEMIPRIMES
+)
+
+BACKENDS = ['python'] + (['numba'] if HAVE_NUMBA else [])
+
+
+def reference_factorize(n: int) -> Factorization:
+    factorization = []
+    d = 2
+    while d * d <= n:
+        e = 0
+        while n % d == 0:
+            n //= d
+            e += 1
+        if e:
+            factorization.append((d, e))
+        d += 1
+
+    if n > 1:
+        factorization.append((n, 1))
+
+    return factorization
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    prev_backend = get_backend()
+    set_backend(request.param)
+    yield request.param
+    set_backend(prev_backend)
+
+
+@pytest.fixture(scope='module')
+def small_expected():
+    return [reference_factorize(n) for n in SMALL_NUMBERS]
+
+
+@pytest.fixture(scope='module')
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+def check_factorizations(numbers, expected, executor):
+    assert [factorize(n) for n in numbers] == expected
+    assert factorize_batch(numbers) == expected
+    for (n, factorization) in zip(numbers, expected):
+        for array in (factorize_array(n), factorize_array_sharded(n, executor, 8)):
+            assert array.tolist() == [list(pair) for pair in factorization]
+            assert not array.flags.writeable
+
+
+def test_small_numbers(backend, small_expected, executor):
+    check_factorizations(SMALL_NUMBERS, small_expected, executor)
+
+
+@pytest.mark.skipif(not HAVE_NUMBA, reason='numba is not installed')
+def test_large_numbers(executor):
+    numbers = LARGE_PRIMES + LARGE_FACTOR_SEMIPRIMES
+    expected = (
+        [[(p, 1)] for p in LARGE_PRIMES] +
+        [[(33554393, 1), (67108879, 1)], [(2**31 - 19, 1), (2**31 - 1, 1)]]
+    )
+    check_factorizations(numbers, expected, executor)
+
+
+def test_thread_counts(backend):
+    numbers = [408216, 1001, 2**31 - 1]
+    expected = [reference_factorize(n) for n in numbers]
+    for num_threads in (0, 1, MAX_THREADS + 1):
+        assert factorize_batch(numbers, num_threads) == expected
+
+
+def test_ascending_order(backend):
+    for factorization in factorize_batch(SMALL_NUMBERS):
+        bases = [b for (b, e) in factorization]
+        assert bases == sorted(bases)
+        assert len(set(bases)) == len(bases)
+
+
+@pytest.mark.skipif(not HAVE_NUMBA, reason='numba is not installed')
+def test_factor_in_range():
+    assert factor_in_range(35, 2, 5) == 5
+    assert factor_in_range(35, 6, 7) == 7
+    assert factor_in_range(2**31 - 1, 2, 46340) == 0
+    # Inverted ranges contain no factors
+    assert factor_in_range(1048573 * 34359738421, 1048574, 185363) == 0
+
+
+def test_invalid_numbers(backend):
+    with pytest.raises(Exception):
+        factorize(1)
+    with pytest.raises(Exception):
+        factorize_array(2**62 + 1)
+    with pytest.raises(Exception):
+        factorize_batch([6, 0])
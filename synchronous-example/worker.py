@@ -0,0 +1,126 @@
+'''
+Task logic behind the HTTP server.  This module is plain Python but is
+fully annotated so it can be compiled ahead of time with mypyc
+("mypyc worker.py"), in which case the compiled extension module is
+imported in its place.
+'''
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from factorization import (
+    MIN_SHARDED_NUMBER, Factorization, factorize_array, factorize_array_sharded,
+    factorize_batch, set_backend,
+)
+
+
+log = logging.getLogger(__name__)
+
+# Number of recent factorizations remembered by each server process
+COMPUTE_CACHE_SIZE = 4096
+
+# Ranges each search for the factors of a single large number is split
+# into, per search thread; more ranges than threads, so little work is
+# wasted on the ranges already running when a factor is found
+SEARCH_SHARDS_PER_THREAD = 4
+
+# Thread pool searching for the factors of a single large number in
+# parallel, and the number of ranges each search is split into; set up
+# by Worker (no pool means numbers are factorized on the calling thread)
+_search_executor: Optional[ThreadPoolExecutor] = None
+_search_shards = 0
+
+
+@lru_cache(maxsize=COMPUTE_CACHE_SIZE)
+def _compute(number: int) -> np.ndarray:
+    # Module-level (rather than a Worker method) so the cache is keyed on
+    # the number alone; the returned array is read-only, so cached results
+    # can't be mutated
+    if _search_executor is None:
+        return factorize_array(number)
+    else:
+        return factorize_array_sharded(number, _search_executor, _search_shards)
+
+
+def _start_search_pool(num_threads: int) -> None:
+    # Search for factors on num_threads threads, or on the calling thread
+    # if there is only one
+    global _search_executor, _search_shards
+    if _search_executor is not None:
+        _search_executor.shutdown(wait=False)
+
+    if num_threads > 1:
+        _search_executor = ThreadPoolExecutor(max_workers=num_threads)
+        _search_shards = SEARCH_SHARDS_PER_THREAD * num_threads
+    else:
+        _search_executor = None
+        _search_shards = 0
+
+
+def format_factorization(factorization: Iterable[Sequence[int]]) -> str:
+    # factorize and factorize_batch return factors in ascending order of
+    # base, so the factorization is formatted as is
+    return ' '.join([str(b) + '^' + str(e) for (b, e) in factorization])
+
+
+class Worker:
+    num_threads: Optional[int]
+
+    def __init__(self, num_threads: Optional[int] = None,
+                 backend: Optional[str] = None) -> None:
+        log.info('Initializing...')
+        if backend is not None:
+            set_backend(backend)
+        # Maximum number of threads used to factorize each batch, and to
+        # search for the factors of a single large number
+        self.num_threads = num_threads
+        _start_search_pool(num_threads if num_threads is not None else os.cpu_count() or 1)
+        # Compile the factorization kernels now (or load them from the
+        # on-disk cache) so the first request doesn't pay for it
+        factorize_array(15)
+        if _search_executor is not None:
+            factorize_array_sharded(MIN_SHARDED_NUMBER, _search_executor, _search_shards)
+        factorize_batch([15], self.num_threads)
+        log.info('Done.')
+
+    def do_task(self, number: int) -> Dict[str, Any]:
+        # Do the heavy lifting here
+        # Check the level once so the (common) case of INFO logging being
+        # disabled costs a single call per request
+        log_info = log.isEnabledFor(logging.INFO)
+        if log_info:
+            log.info('Finding prime factorization of %d...', number)
+        factorization: np.ndarray = _compute(number)
+        if log_info:
+            log.info('Done.')
+
+        return {
+            'number': number,
+            'factorization': factorization,
+            'factorization_str': format_factorization(factorization.tolist())
+        }
+
+    def do_task_batch(self, numbers: List[int]) -> List[Dict[str, Any]]:
+        log_info = log.isEnabledFor(logging.INFO)
+        if log_info:
+            log.info('Finding prime factorizations of %d numbers...', len(numbers))
+        factorizations: List[Factorization] = factorize_batch(numbers, self.num_threads)
+        if log_info:
+            log.info('Done.')
+
+        return [
+            {
+                'number': number,
+                'factorization': factorization,
+                'factorization_str': format_factorization(factorization)
+            }
+            for (number, factorization) in zip(numbers, factorizations)
+        ]
+
+    def cache_stats(self) -> Dict[str, int]:
+        return _compute.cache_info()._asdict()